@@ -1,37 +1,68 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from rest_framework.response import Response
 from rest_framework import status
 
 from users.models import Subscription
 
 
-class SubscriptionMixin:
-    def get_is_subscribed(self, obj):
+class AuthUserMixin:
+    def get_auth_user(self):
+        if 'auth_user' in self.context:
+            return self.context['auth_user']
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return Subscription.objects.filter(
-                user=request.user, subscribed_to=obj).exists()
-        return False
+            return request.user
+        return None
 
 
-class RecipeActionMixin:
-    def handle_recipe_action(self, request, recipe, model, action):
-        exists = model.objects.filter(
-            user=request.user, recipe=recipe
-        ).exists()
+class SubscriptionMixin(AuthUserMixin):
+    def get_is_subscribed(self, obj):
+        user = self.get_auth_user()
+        if user is None:
+            return False
+        subscribed_ids = self.context.get('subscribed_ids')
+        if subscribed_ids is not None:
+            return obj.pk in subscribed_ids
+        annotated = getattr(obj, 'is_subscribed', None)
+        if annotated is not None:
+            return annotated
+        return Subscription.objects.filter(
+            user=user, subscribed_to=obj).exists()
+
+
+class RelationMixin:
+    @staticmethod
+    def _create_relation(model, **kwargs):
+        try:
+            with transaction.atomic():
+                model.objects.create(**kwargs)
+        except IntegrityError:
+            return False
+        return True
+
+    @staticmethod
+    def _delete_relation(model, **kwargs):
+        deleted, _ = model.objects.filter(**kwargs).delete()
+        return deleted
 
+
+class RecipeActionMixin(RelationMixin):
+    def handle_recipe_action(self, request, recipe, model, action):
+        user = request.user
         if action == 'add':
-            if exists:
+            if not self._create_relation(model, user=user, recipe=recipe):
                 return Response(
                     {"detail": "Рецепт уже есть в списке."},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            model.objects.create(user=request.user, recipe=recipe)
             serializer = self.get_serializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         elif action == 'remove':
-            if exists:
-                model.objects.filter(user=request.user, recipe=recipe).delete()
+            if self._delete_relation(model, user=user, recipe=recipe):
                 return Response(status=status.HTTP_204_NO_CONTENT)
             return Response(
                 {"detail": "Рецепт не найден."},
@@ -39,3 +70,30 @@ class RecipeActionMixin:
             )
 
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class CachedListMixin:
+    list_cache_timeout = 60 * 60
+
+    @staticmethod
+    def _get_list_cache_version_key(model):
+        return f'{model._meta.label_lower}:list_version'
+
+    @classmethod
+    def invalidate_list_cache(cls, model):
+        cache.set(cls._get_list_cache_version_key(model), uuid4().hex, None)
+
+    def list(self, request, *args, **kwargs):
+        model = self.queryset.model
+        version = cache.get_or_set(
+            self._get_list_cache_version_key(model), uuid4().hex, None
+        )
+        key = (
+            f'{model._meta.label_lower}:list:{version}:'
+            f'{request.query_params.urlencode()}'
+        )
+        data = cache.get(key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, self.list_cache_timeout)
+        return Response(data)
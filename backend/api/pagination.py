@@ -1,7 +1,19 @@
-from rest_framework.pagination import PageNumberPagination
-
-
-class CustomPagination(PageNumberPagination):
-    page_size_query_param = 'limit'
-    page_size = 10
-    max_page_size = 100
+from django.core.paginator import Paginator
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination
+
+
+class PkCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        if isinstance(self.object_list, QuerySet):
+            return self.object_list.values('pk').order_by().count()
+        return super().count
+
+
+class CustomPagination(PageNumberPagination):
+    django_paginator_class = PkCountPaginator
+    page_size_query_param = 'limit'
+    page_size = 10
+    max_page_size = 100
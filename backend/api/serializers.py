@@ -1,9 +1,10 @@
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
 
 from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
 from .fields import Base64ImageField
-from .mixins import SubscriptionMixin
+from .mixins import AuthUserMixin, SubscriptionMixin
 
 User = get_user_model()
 
@@ -29,7 +30,7 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class UserDetailSerializer(SubscriptionMixin, serializers.ModelSerializer):
-    avatar = Base64ImageField(required=False)
+    avatar = serializers.ImageField(read_only=True)
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -57,7 +58,7 @@ class UserCreateSerializer(serializers.ModelSerializer):
 
 
 class UserListSerializer(SubscriptionMixin, serializers.ModelSerializer):
-    avatar = Base64ImageField(required=True)
+    avatar = serializers.ImageField(read_only=True)
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -68,12 +69,10 @@ class UserListSerializer(SubscriptionMixin, serializers.ModelSerializer):
         ]
 
     def update(self, instance, validated_data):
-        super().update(instance, validated_data)
-
-        if 'avatar' in validated_data:
-            instance.avatar = validated_data.get('avatar', instance.avatar)
-
-        instance.save()
+        if validated_data:
+            User.objects.filter(pk=instance.pk).update(**validated_data)
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
         return instance
 
 
@@ -86,7 +85,14 @@ class IngredientSerializer(serializers.ModelSerializer):
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tag
-        fields = "__all__"
+        fields = ['id', 'name', 'slug']
+
+    def to_representation(self, instance):
+        return {
+            'id': instance.id,
+            'name': instance.name,
+            'slug': instance.slug,
+        }
 
 
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
@@ -99,14 +105,23 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         model = IngredientInRecipe
         fields = ['id', 'name', 'measurement_unit', 'amount']
 
+    def to_representation(self, instance):
+        ingredient = instance.ingredient
+        return {
+            'id': ingredient.id,
+            'name': ingredient.name,
+            'measurement_unit': ingredient.measurement_unit,
+            'amount': instance.amount,
+        }
+
 
-class RecipeListSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(AuthUserMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     author = UserDetailSerializer(read_only=True)
     ingredients = IngredientInRecipeSerializer(
         many=True, source='ingredientinrecipe'
     )
-    image = Base64ImageField()
+    image = serializers.ImageField(read_only=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -114,21 +129,55 @@ class RecipeListSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = "__all__"
 
+    @classmethod
+    def get_prefetch_lookups(cls):
+        return [
+            'tags',
+            Prefetch(
+                'ingredientinrecipe',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                ).only(
+                    'id', 'amount', 'recipe_id', 'ingredient_id',
+                    'ingredient__name', 'ingredient__measurement_unit'
+                )
+            ),
+        ]
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        return queryset.select_related('author').only(
+            'id', 'name', 'image', 'text', 'cooking_time', 'author_id',
+            'author__email', 'author__username', 'author__first_name',
+            'author__last_name', 'author__avatar'
+        ).prefetch_related(*cls.get_prefetch_lookups())
+
     def get_is_favorited(self, obj):
-        return self._is_user_related(obj, 'favorites')
+        return self._is_user_related(
+            obj, 'favorites', 'is_favorited', 'favorited_ids'
+        )
 
     def get_is_in_shopping_cart(self, obj):
-        return self._is_user_related(obj, 'shopping_cart')
+        return self._is_user_related(
+            obj, 'shopping_cart', 'is_in_shopping_cart',
+            'in_shopping_cart_ids'
+        )
 
-    def _is_user_related(self, obj, relation_name):
-        user = self.context['request'].user
-        if user.is_authenticated:
-            return getattr(obj, relation_name).filter(user=user).exists()
-        return False
+    def _is_user_related(self, obj, relation_name, annotation_name, ids_key):
+        user = self.get_auth_user()
+        if user is None:
+            return False
+        related_ids = self.context.get(ids_key)
+        if related_ids is not None:
+            return obj.id in related_ids
+        annotated = getattr(obj, annotation_name, None)
+        if annotated is not None:
+            return annotated
+        return getattr(obj, relation_name).filter(user=user).exists()
 
 
 class IngredientAmountSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
@@ -160,9 +209,13 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                 "Поле 'tags' не может быть пустым."
             )
 
-        tag_ids = [tag.id for tag in value]
-        if len(tag_ids) != len(set(tag_ids)):
-            raise serializers.ValidationError("Теги не могут повторяться.")
+        tag_ids = set()
+        for tag in value:
+            if tag.id in tag_ids:
+                raise serializers.ValidationError(
+                    "Теги не могут повторяться."
+                )
+            tag_ids.add(tag.id)
 
         return value
 
@@ -172,20 +225,29 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                 "Добавьте хотя бы один ингредиент!"
             )
 
-        ingredient_ids = []
+        ingredient_ids = set()
         for ingredient in ingredients:
             if 'id' not in ingredient or 'amount' not in ingredient:
                 raise serializers.ValidationError(
                     "Каждый ингредиент должен содержать 'id' и 'amount'."
                 )
 
-            ingredient_ids.append(ingredient['id'])
+            if ingredient['id'] in ingredient_ids:
+                raise serializers.ValidationError(
+                    "Рецепт не может включать два одинаковых ингредиента!"
+                )
+            ingredient_ids.add(ingredient['id'])
 
-        if len(ingredient_ids) != len(set(ingredient_ids)):
+        ingredient_map = Ingredient.objects.in_bulk(ingredient_ids)
+        missing_ids = ingredient_ids - ingredient_map.keys()
+        if missing_ids:
             raise serializers.ValidationError(
-                "Рецепт не может включать два одинаковых ингредиента!"
+                f"Ингредиенты не найдены: {sorted(missing_ids)}."
             )
 
+        for ingredient in ingredients:
+            ingredient['id'] = ingredient_map[ingredient['id']]
+
         return ingredients
 
     def validate_cooking_time(self, value):
@@ -196,18 +258,41 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         return value
 
     def _handle_ingredients(self, recipe, ingredients):
-        ingredient_objects = []
-        for ingredient in ingredients:
-            amount = ingredient.get("amount")
-            ingredient_id = ingredient.get("id").pk
+        ingredient_objects = [
+            IngredientInRecipe(
+                recipe=recipe, ingredient=ingredient['id'],
+                amount=ingredient['amount']
+            )
+            for ingredient in ingredients
+        ]
+        IngredientInRecipe.objects.bulk_create(
+            ingredient_objects, batch_size=500, ignore_conflicts=True
+        )
 
-            ingredient_objects.append(
-                IngredientInRecipe(
-                    recipe=recipe, ingredient_id=ingredient_id,
-                    amount=amount
-                )
+    def _update_ingredients(self, recipe, ingredients):
+        new_ids = {ingredient['id'].pk for ingredient in ingredients}
+        recipe.ingredientinrecipe.exclude(ingredient_id__in=new_ids).delete()
+
+        existing = {
+            row.ingredient_id: row
+            for row in recipe.ingredientinrecipe.only(
+                'id', 'recipe_id', 'ingredient_id', 'amount'
             )
-        IngredientInRecipe.objects.bulk_create(ingredient_objects)
+        }
+        changed_rows = []
+        new_ingredients = []
+        for ingredient in ingredients:
+            row = existing.get(ingredient['id'].pk)
+            if row is None:
+                new_ingredients.append(ingredient)
+            elif row.amount != ingredient['amount']:
+                row.amount = ingredient['amount']
+                changed_rows.append(row)
+
+        IngredientInRecipe.objects.bulk_update(
+            changed_rows, ['amount'], batch_size=500
+        )
+        self._handle_ingredients(recipe, new_ingredients)
 
     def create(self, validated_data):
         author = self.context.get("request").user
@@ -228,28 +313,36 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
         ingredients = validated_data.pop("ingredients", None)
         if ingredients is not None:
-            instance.ingredients.clear()
-
-            self._handle_ingredients(instance, ingredients)
+            self._update_ingredients(instance, ingredients)
 
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
-        serializer = RecipeListSerializer(
-            instance, context={"request": self.context.get("request")}
+        prefetch_related_objects(
+            [instance], *RecipeListSerializer.get_prefetch_lookups()
         )
+        serializer = RecipeListSerializer(instance, context=self.context)
 
         return serializer.data
 
 
-class RecipeSubscriptionSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Recipe
-        fields = ['id', 'name', 'image', 'cooking_time']
+class RecipeSubscriptionSerializer(serializers.Serializer):
+    id = serializers.IntegerField(read_only=True)
+    name = serializers.CharField(read_only=True)
+    image = serializers.ImageField(read_only=True)
+    cooking_time = serializers.IntegerField(read_only=True)
+
+    def to_representation(self, instance):
+        return {
+            'id': instance.id,
+            'name': instance.name,
+            'image': self.fields['image'].to_representation(instance.image),
+            'cooking_time': instance.cooking_time,
+        }
 
 
 class SubscriptionSerializer(SubscriptionMixin, serializers.ModelSerializer):
-    avatar = Base64ImageField(required=False)
+    avatar = serializers.ImageField(read_only=True)
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
@@ -261,13 +354,21 @@ class SubscriptionSerializer(SubscriptionMixin, serializers.ModelSerializer):
             'is_subscribed', 'recipes', 'recipes_count'
         ]
 
+    def get_is_subscribed(self, obj):
+        return True
+
     def get_recipes(self, obj):
         recipes_limit = self.context.get('recipes_limit', None)
-        recipes = Recipe.objects.filter(author=obj)
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
+        recipes = getattr(obj, 'prefetched_recipes', None)
+        if recipes is None:
+            recipes = Recipe.objects.filter(author=obj)
+        if recipes_limit is not None:
+            recipes = recipes[:recipes_limit]
         return RecipeSubscriptionSerializer(
             recipes, many=True, context=self.context).data
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
+        recipes = getattr(obj, 'prefetched_recipes', None)
+        if recipes is not None:
+            return len(recipes)
+        return obj.recipe_set.count()
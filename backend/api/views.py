@@ -1,7 +1,11 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import (
+    CharField, Exists, F, OuterRef, Prefetch, Sum, Value
+)
+from django.db.models.functions import Cast, Concat
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from djoser import views as djoser_views
 from djoser.serializers import SetPasswordSerializer
@@ -17,7 +21,7 @@ from recipes.models import (
     Recipe, ShoppingCart, Tag
 )
 from users.models import Subscription
-from .mixins import RecipeActionMixin
+from .mixins import CachedListMixin, RecipeActionMixin, RelationMixin
 from .serializers import (
     IngredientSerializer, RecipeCreateSerializer, RecipeListSerializer,
     RecipeSubscriptionSerializer, SubscriptionSerializer, TagSerializer,
@@ -29,46 +33,75 @@ from .serializers import (
 User = get_user_model()
 
 
-class UserViewSet(djoser_views.UserViewSet):
-    queryset = User.objects.all().order_by('username')
+class UserViewSet(RelationMixin, djoser_views.UserViewSet):
+    queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = CustomPagination
     permission_classes = [permissions.AllowAny]
 
+    # (method, action) -> serializer; (method, None) is the fallback
+    # for the method's remaining actions.
+    _SERIALIZER_MAP = {
+        ('GET', 'list'): UserListSerializer,
+        ('GET', 'subscriptions'): SubscriptionSerializer,
+        ('POST', 'subscribe'): SubscriptionSerializer,
+        ('POST', 'change_password'): SetPasswordSerializer,
+        ('POST', None): UserCreateSerializer,
+    }
+    _PERMISSION_MAP = {
+        'list': [permissions.AllowAny],
+        'me': [permissions.IsAuthenticated],
+        'update_avatar': [permissions.IsAuthenticated],
+    }
+
     def get_permissions(self):
-        if self.action == 'list':
-            return [permissions.AllowAny()]
-        elif self.action in ['me', 'update_avatar']:
-            return [permissions.IsAuthenticated()]
-        return super().get_permissions()
+        permission_classes = self._PERMISSION_MAP.get(self.action)
+        if permission_classes is None:
+            return super().get_permissions()
+        return [permission() for permission in permission_classes]
 
     def get_serializer_class(self):
-        if self.request.method == 'GET':
-            if self.action == 'list':
-                return UserListSerializer
-            elif self.action == 'subscriptions':
-                return SubscriptionSerializer
-            return UserDetailSerializer
-        elif self.request.method == 'POST':
-            if self.action == 'subscribe':
-                return SubscriptionSerializer
-            elif self.action == 'change_password':
-                return SetPasswordSerializer
-            return UserCreateSerializer
-        elif self.request.method in ['PUT', 'PATCH']:
-            return UserDetailSerializer
-        return UserDetailSerializer
+        method = self.request.method
+        return (
+            self._SERIALIZER_MAP.get((method, self.action))
+            or self._SERIALIZER_MAP.get((method, None), UserDetailSerializer)
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        user = self.request.user
+        context['auth_user'] = user if user.is_authenticated else None
+        return context
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                is_subscribed=Exists(Subscription.objects.filter(
+                    user=user, subscribed_to=OuterRef('pk')
+                ))
+            )
+        return queryset
+
+    def get_recipes_limit(self):
+        try:
+            recipes_limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return recipes_limit if recipes_limit >= 0 else None
 
     @action(detail=False, methods=['post'], url_path='set_password')
     def change_password(self, request):
+        user = request.user
         serializer = SetPasswordSerializer(
-            request.user, data=request.data, context={'request': request}
+            user, data=request.data, context={'request': request}
         )
 
         serializer.is_valid(raise_exception=True)
 
-        request.user.set_password(serializer.validated_data['new_password'])
-        request.user.save()
+        user.set_password(serializer.validated_data['new_password'])
+        user.save()
 
         return Response(
             {"detail": "Пароль успешно изменён."},
@@ -88,49 +121,63 @@ class UserViewSet(djoser_views.UserViewSet):
         permission_classes=[permissions.IsAuthenticated]
     )
     def subscriptions(self, request):
-        subscriptions = request.user.subscriptions.all().order_by('id')
-        recipes_limit = request.query_params.get('recipes_limit', None)
+        subscriptions = User.objects.filter(
+            subscribers__user=request.user
+        ).prefetch_related(
+            Prefetch(
+                'recipe_set',
+                queryset=Recipe.objects.only(
+                    'id', 'name', 'image', 'cooking_time', 'author_id'
+                ),
+                to_attr='prefetched_recipes'
+            )
+        ).order_by('subscribers__id')
+        recipes_limit = self.get_recipes_limit()
         paginator = self.pagination_class()
         result_page = paginator.paginate_queryset(subscriptions, request)
 
-        results = [
-            SubscriptionSerializer(
-                subscription.subscribed_to, context={
-                    'request': request, 'recipes_limit': recipes_limit
-                }
-            ).data for subscription in result_page
-        ]
+        serializer = SubscriptionSerializer(
+            result_page, many=True, context={
+                'request': request, 'recipes_limit': recipes_limit
+            }
+        )
 
-        return paginator.get_paginated_response(results)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(
         detail=True, methods=['post', 'delete'],
         permission_classes=[permissions.IsAuthenticated]
     )
     def subscribe(self, request, id=None):
-        user_to_subscribe = get_object_or_404(User, id=id)
+        try:
+            user_id = int(id)
+        except (TypeError, ValueError):
+            raise Http404
 
-        if user_to_subscribe == request.user:
+        user = request.user
+        if user_id == user.id:
             return Response(
                 {'detail': 'Нельзя подписаться на самого себя.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        subscription_exists = Subscription.objects.filter(
-            user=request.user, subscribed_to=user_to_subscribe
-        ).exists()
+        user_to_subscribe = get_object_or_404(
+            User.objects.only(
+                'id', 'email', 'username', 'first_name', 'last_name', 'avatar'
+            ),
+            id=user_id
+        )
 
         if request.method == 'POST':
-            if subscription_exists:
+            if not self._create_relation(
+                Subscription, user=user, subscribed_to=user_to_subscribe
+            ):
                 return Response(
                     {'detail': 'Вы уже подписаны на этого пользователя.'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            Subscription.objects.create(
-                user=request.user, subscribed_to=user_to_subscribe
-            )
-            recipes_limit = request.query_params.get('recipes_limit', None)
+            recipes_limit = self.get_recipes_limit()
             user_data = SubscriptionSerializer(
                 user_to_subscribe, context={
                     'request': request, 'recipes_limit': recipes_limit
@@ -138,10 +185,9 @@ class UserViewSet(djoser_views.UserViewSet):
             ).data
             return Response(user_data, status=status.HTTP_201_CREATED)
 
-        if subscription_exists:
-            Subscription.objects.filter(
-                user=request.user, subscribed_to=user_to_subscribe
-            ).delete()
+        if self._delete_relation(
+            Subscription, user=user, subscribed_to=user_to_subscribe
+        ):
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         return Response(
@@ -173,12 +219,12 @@ class UserAvatarView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
 
@@ -191,88 +237,178 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 class RecipeViewSet(viewsets.ModelViewSet, RecipeActionMixin):
-    queryset = Recipe.objects.all().order_by('id')
+    queryset = Recipe.objects.all()
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     pagination_class = CustomPagination
 
+    _ACTION_SERIALIZERS = {
+        'shopping_cart': RecipeSubscriptionSerializer,
+        'favorite': RecipeSubscriptionSerializer,
+    }
+    _METHOD_SERIALIZERS = {
+        'POST': RecipeCreateSerializer,
+        'PATCH': RecipeCreateSerializer,
+    }
+    _ACTION_PERMISSIONS = {
+        'shopping_cart': [permissions.IsAuthenticated],
+        'favorite': [permissions.IsAuthenticated],
+    }
+    _METHOD_PERMISSIONS = {
+        'PATCH': [IsAuthor],
+        'DELETE': [IsAuthor],
+    }
+
     def get_serializer_class(self):
-        if self.action in ['shopping_cart', 'favorite']:
-            return RecipeSubscriptionSerializer
-        elif self.request.method in ['POST', 'PATCH']:
-            return RecipeCreateSerializer
-        return RecipeListSerializer
+        return (
+            self._ACTION_SERIALIZERS.get(self.action)
+            or self._METHOD_SERIALIZERS.get(
+                self.request.method, RecipeListSerializer
+            )
+        )
 
     def get_permissions(self):
-        if self.action in ['shopping_cart', 'favorite']:
-            self.permission_classes = [permissions.IsAuthenticated]
-        elif self.request.method in ['PATCH', 'DELETE']:
-            self.permission_classes = [IsAuthor]
-        return super().get_permissions()
+        permission_classes = (
+            self._ACTION_PERMISSIONS.get(self.action)
+            or self._METHOD_PERMISSIONS.get(self.request.method)
+        )
+        if permission_classes is None:
+            return super().get_permissions()
+        return [permission() for permission in permission_classes]
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
+        user = self.request.user
+        context['auth_user'] = user if user.is_authenticated else None
         return context
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        user = self.request.user
-
-        is_favorited = self.request.query_params.get('is_favorited', None)
-        is_in_shopping_cart = self.request.query_params.get(
-            'is_in_shopping_cart', None)
-        author_id = self.request.query_params.get('author', None)
-        tags = self.request.query_params.getlist('tags')
-
-        if is_favorited == '1' and user.is_authenticated:
-            queryset = queryset.filter(favorites__user=user)
+        if self.action == 'list':
+            queryset = RecipeListSerializer.setup_eager_loading(queryset)
+            return self.filter_list_queryset(queryset)
+        if self.action == 'retrieve':
+            queryset = RecipeListSerializer.setup_eager_loading(queryset)
+            return self.annotate_user_relations(queryset)
+        if self.action in ['update', 'partial_update']:
+            return self.annotate_user_relations(queryset)
+        return queryset
 
-        if is_in_shopping_cart == '1' and user.is_authenticated:
-            queryset = queryset.filter(shopping_cart__user=user)
+    def annotate_user_relations(self, queryset):
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            ))
+        )
 
+    def filter_list_queryset(self, queryset):
+        user = self.request.user
+        query_params = self.request.query_params
+
+        if user.is_authenticated:
+            if query_params.get('is_favorited') == '1':
+                queryset = queryset.filter(Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )))
+            if query_params.get('is_in_shopping_cart') == '1':
+                queryset = queryset.filter(Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )))
+
+        author_id = query_params.get('author')
         if author_id:
             queryset = queryset.filter(author_id=author_id)
 
+        tags = query_params.getlist('tags')
         if tags:
-            queryset = queryset.filter(tags__slug__in=tags).distinct()
+            queryset = queryset.filter(Exists(
+                Recipe.tags.through.objects.filter(
+                    recipe_id=OuterRef('pk'), tag__slug__in=tags
+                )
+            ))
 
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        recipes = page if page is not None else list(queryset)
+
+        context = self.get_serializer_context()
+        user = request.user
+        if user.is_authenticated:
+            context['subscribed_ids'] = set(
+                Subscription.objects.filter(
+                    user=user,
+                    subscribed_to__in={recipe.author_id for recipe in recipes}
+                ).values_list('subscribed_to_id', flat=True)
+            )
+            recipe_ids = [recipe.id for recipe in recipes]
+            context['favorited_ids'] = set(
+                Favorite.objects.filter(
+                    user=user, recipe_id__in=recipe_ids
+                ).values_list('recipe_id', flat=True)
+            )
+            context['in_shopping_cart_ids'] = set(
+                ShoppingCart.objects.filter(
+                    user=user, recipe_id__in=recipe_ids
+                ).values_list('recipe_id', flat=True)
+            )
+
+        serializer = self.get_serializer(recipes, many=True, context=context)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
     @action(detail=True, methods=['get'], url_path='get-link')
     def get_link(self, request, pk=None):
         try:
-            recipe = self.get_object()
-            short_link = f"{settings.BASE_URL}/recipes/{recipe.id}"
-            return Response(
-                {'short-link': short_link}, status=status.HTTP_200_OK
-            )
-        except Recipe.DoesNotExist:
+            recipe_id = int(pk)
+        except (TypeError, ValueError):
+            recipe_id = None
+
+        if recipe_id is None or not Recipe.objects.filter(
+            pk=recipe_id
+        ).exists():
             return Response(
                 {'detail': 'Страница не найдена.'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
+        return Response(
+            {'short-link': f"{settings.SHORT_LINK_BASE}/{recipe_id}"},
+            status=status.HTTP_200_OK
+        )
+
     @action(
         detail=False, methods=['get'],
         permission_classes=[permissions.IsAuthenticated]
     )
     def download_shopping_cart(self, request):
         user = request.user
-        ingredients = IngredientInRecipe.objects.filter(
+        purchased_in_file = IngredientInRecipe.objects.filter(
             recipe__shopping_cart__user=user
         ).values(
             'ingredient__name', 'ingredient__measurement_unit'
         ).order_by(
             'ingredient__name'
-        ).annotate(ingredient_total=Sum('amount'))
-
-        purchased_in_file = ""
-        for ingredient in ingredients:
-            purchased_in_file += (
-                f"{ingredient['ingredient__name']} - "
-                f"{ingredient['ingredient_total']} "
-                f"{ingredient['ingredient__measurement_unit']}\n"
-            )
+        ).annotate(
+            ingredient_total=Sum('amount')
+        ).aggregate(purchased=StringAgg(
+            Concat(
+                F('ingredient__name'), Value(' - '),
+                Cast('ingredient_total', CharField()), Value(' '),
+                F('ingredient__measurement_unit'), Value('\n')
+            ),
+            delimiter='', ordering='ingredient__name'
+        ))['purchased'] or ''
+
         response = HttpResponse(purchased_in_file, content_type='text/plain')
         response['Content-Disposition'] = (
             'attachment; filename="shopping_cart.txt"'
@@ -8,6 +8,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 BASE_URL = 'https://foodgrams.publicvm.com'
 
+SHORT_LINK_BASE = f'{BASE_URL}/recipes'
+
 SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-cg6*%6d51ef8f')
 
 DEBUG = os.getenv('DEBUG') == 'True'
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Count
 
 from .models import Ingredient, IngredientInRecipe, Recipe, Tag
 
@@ -7,11 +8,18 @@ class RecipeAdmin(admin.ModelAdmin):
     list_display = ('name', 'author')
     search_fields = ('name', 'author__username')
     list_filter = ('tags',)
+    list_select_related = ('author',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            _favorite_count=Count('favorites')
+        )
 
     def favorite_count(self, obj):
-        return obj.favorites.count()
+        return obj._favorite_count
 
     favorite_count.short_description = 'Количество добавлений в избранное'
+    favorite_count.admin_order_field = '_favorite_count'
 
     list_display += ('favorite_count',)
 
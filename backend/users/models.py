@@ -32,6 +32,7 @@ class User(AbstractUser):
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
 
     class Meta:
+        ordering = ['username']
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
 
@@ -58,6 +59,7 @@ class Subscription(models.Model):
                 name='unique_subscription'
             )
         ]
+        ordering = ['id']
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
 